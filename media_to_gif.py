@@ -3,23 +3,40 @@
 Script to generate GIFs with improved captions for every line of dialogue in subtitle files for multiple videos.
 
 Usage:
-    $ python3 media_to_gif.py
+    $ python3 media_to_gif.py [--scale-flags {fast_bilinear,bilinear,bicubic,lanczos}]
 """
 
 import os
 import sys
 import re
+import argparse
+import mmap
+import asyncio
 import subprocess
-import pysrt
+import tempfile
 import json
 import logging
-import multiprocessing
 from slugify import slugify
 from tqdm import tqdm
-from concurrent.futures import ProcessPoolExecutor, as_completed
-import time
 import platform  # To detect the OS
-from shutil import which
+from collections import namedtuple
+from html import escape as escape_markup
+from shutil import which, rmtree
+
+try:
+    import hyperscan  # Optional: faster skip-pattern matching on large subtitle files
+except ImportError:
+    hyperscan = None
+
+try:
+    import orjson  # Optional: faster metadata.json encoding
+except ImportError:
+    orjson = None
+
+try:
+    import pyvips  # Optional: required for CAPTION_RENDERER = "vips"
+except ImportError:
+    pyvips = None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -29,12 +46,29 @@ FPS = 15
 WIDTH = 800
 FONTSIZE = 24
 OUTLINE = 2
+SCALE_FLAGS = "bicubic"  # Resampling filter; GIF's 256 colours hide the difference from lanczos
 MAX_WORKERS = os.cpu_count()
+BATCH_SIZE = 32  # Subtitles extracted per ffmpeg invocation
+BATCH_MAX_GAP = 10  # Seconds between subtitles before a new batch (and a fresh seek) is started
+BATCH_MAX_SPAN = 120  # Seconds of video a single batch may decode
 
 # Directories
 INPUT_DIR = "input"
 OUTPUT_DIR = "gifs"
 
+# Supported file types
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.mkv', '.avi', '.mov'})
+SUBTITLE_EXTENSIONS = frozenset({'.srt', '.sub', '.ass'})
+
+# Caption Rendering Configuration
+# "libass": captions are drawn by FFmpeg's subtitles filter.
+# "vips": each caption is rendered once to a PNG with pyvips and overlaid by FFmpeg.
+CAPTION_RENDERER = "libass"
+
+# Hardware Decoding Configuration
+HWACCEL_ENABLED = True  # Decode on the GPU when a supported device is found
+HWACCEL_PREFERENCE = ['cuda', 'qsv', 'videotoolbox', 'vaapi']
+
 # Skip Patterns Configuration
 SKIP_ENABLED = True  # Enable skipping by default
 SKIP_PATTERNS = [
@@ -45,6 +79,39 @@ SKIP_PATTERNS = [
     r"^\.\.\.",    # Starts with ellipsis
 ]
 
+# One SRT cue: the timing line, then its text lines up to the first blank line.
+# The cue number before the timing line is not needed and is skipped by the search.
+_SRT_CUE_RE = re.compile(
+    rb'(\d+):(\d{2}):(\d{2})[,.](\d{3})[ \t]*-->[ \t]*(\d+):(\d{2}):(\d{2})[,.](\d{3})[^\n]*(?:\n|\Z)'
+    rb'((?:[ \t]*\S[^\n]*(?:\n|\Z))*)'
+)
+
+# libass scales FontSize, Outline and MarginV by frame height / 288; pre-rendered
+# captions assume a 16:9 frame so both renderers produce similar captions
+_CAPTION_SCALE = WIDTH * 9 / 16 / 288
+_CAPTION_MARGIN = round(20 * _CAPTION_SCALE)
+
+# Constant parts of the batch filtergraph and command, built once rather than per batch
+_SUBTITLES_STYLE = (
+    f"force_style='FontName=Arial,FontSize={FONTSIZE},"
+    f"PrimaryColour=&HFFFFFF,OutlineColour=&H000000,BorderStyle=1,Outline={OUTLINE},"
+    f"Shadow=1,Alignment=2,MarginV=20'"
+)
+_PALETTEUSE = "paletteuse=dither=bayer:bayer_scale=3"
+# -y: ffmpeg creates every output before decoding, so a retry has to overwrite them
+_BATCH_CMD = ('ffmpeg', '-nostdin', '-y', '-copyts', '-start_at_zero', '-threads', '1')
+# ffmpeg only warns when an input seek fails and may still exit 0, so the seeked
+# run's log is searched for these whether or not the run succeeded
+_SEEK_ERROR_RE = re.compile(r"(?:(?:could not|couldn't|unable to) seek|seek failed)[^\n]*", re.IGNORECASE)
+
+# Precompiled once: all skip patterns are matched in a single pass
+_STRIP_RE = re.compile(r'<.*?>|{.*?}')
+_SKIP_RE = re.compile('|'.join(f'(?:{pattern})' for pattern in SKIP_PATTERNS))
+
+# Filtered subtitles of one video as parallel lists: start/end times in seconds,
+# stripped text (captions), GIF filenames and raw text (metadata)
+Subtitles = namedtuple('Subtitles', ['starts', 'ends', 'texts', 'filenames', 'raw_texts'])
+
 # Detect if running on Windows or Linux/MacOS
 IS_WINDOWS = platform.system() == "Windows"
 
@@ -54,176 +121,550 @@ def check_ffmpeg_installed():
         logging.error("FFmpeg is not installed or not available in your PATH. Please install it and ensure it's accessible.")
         sys.exit(1)
 
+def detect_hwaccel():
+    """Return the first preferred hardware decoder that ffmpeg can initialise, or None."""
+    if not HWACCEL_ENABLED:
+        return None
+    try:
+        result = subprocess.run(
+            ['ffmpeg', '-hide_banner', '-hwaccels'], check=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # The first line is a header, the rest lists the compiled-in methods
+    available = result.stdout.decode('utf-8', 'replace').splitlines()[1:]
+    for hwaccel in HWACCEL_PREFERENCE:
+        if hwaccel not in available:
+            continue
+        # Being compiled in does not mean the device exists, so try to open it
+        probe = subprocess.run(
+            ['ffmpeg', '-v', 'error', '-init_hw_device', hwaccel,
+             '-f', 'lavfi', '-i', 'nullsrc', '-frames:v', '1', '-f', 'null', '-'],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        if probe.returncode == 0:
+            return hwaccel
+    return None
+
+def detect_filter_script_option():
+    """Return the option that reads a filtergraph from a file, as supported by the installed ffmpeg."""
+    # FFmpeg 7.0 deprecated -filter_complex_script in favour of -/filter_complex.
+    # Probing rather than parsing the version also covers git builds.
+    probe = subprocess.run(
+        ['ffmpeg', '-v', 'error', '-nostdin', '-f', 'lavfi', '-i', 'nullsrc',
+         '-/filter_complex', 'pipe:0', '-frames:v', '1', '-f', 'null', '-'],
+        input=b'[0:v]null', stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    return '-/filter_complex' if probe.returncode == 0 else '-filter_complex_script'
+
+def compile_skip_database():
+    """Return a Hyperscan database and scratch for SKIP_PATTERNS, or (None, None) to use re instead."""
+    if hyperscan is None:
+        return None, None
+    database = hyperscan.Database()
+    try:
+        database.compile(
+            expressions=[pattern.encode() for pattern in SKIP_PATTERNS],
+            ids=list(range(len(SKIP_PATTERNS))),
+            elements=len(SKIP_PATTERNS),
+            flags=[hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_DOTALL] * len(SKIP_PATTERNS),
+        )
+    except hyperscan.error as e:
+        logging.warning(f"Skip patterns are not supported by Hyperscan, using re instead: {e}")
+        return None, None
+    return database, hyperscan.Scratch(database)
+
+_SKIP_DB, _SKIP_SCRATCH = compile_skip_database()
+
+def _on_skip_match(pattern_id, start, end, flags, matches):
+    """Hyperscan match callback: record that a skip pattern matched."""
+    matches.append(pattern_id)
+
+def iter_srt(subtitle_path):
+    """Yield (start, end, text) for each cue of an SRT file, with times in seconds."""
+    with open(subtitle_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return  # mmap cannot map an empty file
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in _SRT_CUE_RE.finditer(data):
+                h1, m1, s1, ms1, h2, m2, s2, ms2 = map(int, match.group(1, 2, 3, 4, 5, 6, 7, 8))
+                text = match.group(9).decode('utf-8', 'replace').replace('\r\n', '\n').rstrip('\r\n')
+                yield h1 * 3600 + m1 * 60 + s1 + ms1 / 1000, h2 * 3600 + m2 * 60 + s2 + ms2 / 1000, text
+
+def format_srt_time(seconds):
+    """Format seconds as an SRT timestamp (HH:MM:SS,mmm)."""
+    minutes, ms = divmod(round(seconds * 1000), 60000)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours:02}:{minutes:02}:{ms // 1000:02},{ms % 1000:03}"
+
 def striptags(text):
     """Strip HTML and special tags from subtitle text."""
-    return re.sub(r'<.*?>|{.*?}', '', text).strip()
+    return _STRIP_RE.sub('', text).strip()
 
-def no_skips(sub):
-    """Filter out subtitles that match skip patterns, if enabled."""
+def no_skips(text):
+    """Filter out stripped subtitle text that matches skip patterns, if enabled."""
     if not SKIP_ENABLED:
         return True  # Process all subtitles if skipping is disabled
-    text = striptags(sub.text)
-    return not any(re.search(pattern, text) for pattern in SKIP_PATTERNS)
+    if _SKIP_DB is not None:
+        matches = []
+        _SKIP_DB.scan(text.encode(), match_event_handler=_on_skip_match, context=matches, scratch=_SKIP_SCRATCH)
+        return not matches
+    return _SKIP_RE.search(text) is None
+
+def make_batches(indices, starts, ends):
+    """Group the given subtitle indices, in playback order, into batches that each cover one short span.
+
+    A batch is closed when it is full, when the next subtitle starts more than
+    BATCH_MAX_GAP after the batch's last end, or when it would cover more than
+    BATCH_MAX_SPAN, so sparse subtitles are seeked to rather than decoded through.
+    """
+    batches = []
+    batch = []
+    batch_start = batch_end = 0
+    for i in sorted(indices, key=starts.__getitem__):
+        if batch and (
+            len(batch) >= BATCH_SIZE
+            or starts[i] - batch_end > BATCH_MAX_GAP
+            or max(batch_end, ends[i]) - batch_start > BATCH_MAX_SPAN
+        ):
+            batches.append(batch)
+            batch = []
+        if not batch:
+            batch_start, batch_end = starts[i], ends[i]
+        batch.append(i)
+        batch_end = max(batch_end, ends[i])
+    if batch:
+        batches.append(batch)
+    return batches
+
+def find_overlapping(starts, ends):
+    """Return the indices of subtitles whose time range overlaps another subtitle's."""
+    overlapping = set()
+    ordered = sorted(range(len(starts)), key=starts.__getitem__)
+    latest_end = float('-inf')
+    for n, i in enumerate(ordered):
+        # Overlaps an earlier subtitle, or the next one starts before this one ends
+        if starts[i] < latest_end or (n + 1 < len(ordered) and starts[ordered[n + 1]] < ends[i]):
+            overlapping.add(i)
+        latest_end = max(latest_end, ends[i])
+    return overlapping
+
+def write_srt(path, cues):
+    """Write (start, end, text) cues to an SRT file, escaping the text for ffmpeg."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for n, (start, end, text) in enumerate(cues, 1):
+            f.write(f"{n}\n{format_srt_time(start)} --> {format_srt_time(end)}\n{escape_for_ffmpeg(text)}\n\n")
 
 def escape_for_ffmpeg(text):
     """Escape necessary characters for ffmpeg."""
     return text.replace('"', '\\"')
 
-def make_gif(args):
-    """Generate a GIF for the given subtitle."""
-    i, sub, video_path, subtitle_path, output_dir = args
-    text = striptags(sub.text)
-
-    gif_filename = f'{i:06}-{slugify(text)}.gif'
-    gif_filepath = os.path.join(output_dir, gif_filename)
-
-    if os.path.exists(gif_filepath) and os.path.getsize(gif_filepath) > 0:
-        return {'text': sub.text, 'path': gif_filepath}
+def escape_filter_arg(value):
+    """Escape a filter option value for a filtergraph: once for the option parser, once for the graph parser."""
+    value = re.sub(r"([\\':])", r"\\\1", value)
+    return re.sub(r"([\\'\[\],;])", r"\\\1", value)
 
-    start = sub.start
-    end = sub.end
-    start_str = str(start).replace(',', '.')
-    duration_str = str(end - start).replace(',', '.')
-
-    escaped_text = escape_for_ffmpeg(text)
-
-    temp_sub_file = os.path.join(output_dir, f"temp_sub_{i}.srt")
+def is_nonempty_file(path):
+    """Return True if path exists and is not empty, using a single stat call."""
     try:
-        with open(temp_sub_file, 'w', encoding='utf-8') as f:
-            f.write(f"1\n00:00:00,000 --> {duration_str}\n{escaped_text}\n")
-    except IOError as e:
-        logging.error(f"Error writing temporary subtitle file: {e}")
-        return None
-
-    # Use '/' for file paths in FFmpeg command, even on Windows (FFmpeg handles it better)
-    if IS_WINDOWS:
-        temp_sub_file_ffmpeg = temp_sub_file.replace('\\', '/')
-        video_path_ffmpeg = video_path.replace('\\', '/')
-    else:
-        temp_sub_file_ffmpeg = temp_sub_file
-        video_path_ffmpeg = video_path
-
-    filter_string = (
-        f"fps={FPS},scale={WIDTH}:-1:flags=lanczos,"
-        f"subtitles='{temp_sub_file_ffmpeg}':force_style='FontName=Arial,FontSize={FONTSIZE},"
-        f"PrimaryColour=&HFFFFFF,OutlineColour=&H000000,BorderStyle=1,Outline={OUTLINE},"
-        f"Shadow=1,Alignment=2,MarginV=20'"
+        return os.stat(path).st_size > 0
+    except OSError:
+        return False
+
+async def run_ffmpeg(cmd, filter_string=None):
+    """Run ffmpeg, optionally with a filtergraph on stdin, and return its log.
+
+    Raises CalledProcessError if it fails.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdin=subprocess.DEVNULL if filter_string is None else subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE
     )
-
+    _, stderr = await process.communicate(None if filter_string is None else filter_string.encode('utf-8'))
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr.decode('utf-8', 'replace'))
+    return stderr.decode('utf-8', 'replace')
+
+async def make_palette(video_path, palette_file, semaphore):
+    """Generate one GIF palette for the whole video, sampled from its keyframes."""
+    video_path_ffmpeg = video_path.replace('\\', '/') if IS_WINDOWS else video_path
     cmd = [
         'ffmpeg',
         '-v', 'error',
-        '-ss', start_str,
+        '-nostdin',
+        '-y',
+        '-threads', '1',
+        '-skip_frame', 'nokey',
         '-i', video_path_ffmpeg,
-        '-t', duration_str,
-        '-vf', filter_string,
-        '-f', 'gif',
-        gif_filepath
+        '-vf', f"scale={WIDTH}:-1:flags={SCALE_FLAGS},palettegen",
+        '-frames:v', '1',
+        palette_file
     ]
+    async with semaphore:
+        await run_ffmpeg(cmd)
+
+def render_caption(text, caption_path):
+    """Render a caption as white text with a black outline on a transparent PNG."""
+    outline = max(1, round(OUTLINE * _CAPTION_SCALE))
+    if not text:
+        pyvips.Image.black(1, 1, bands=4).write_to_file(caption_path)
+        return
+    mask = pyvips.Image.text(
+        escape_markup(text, quote=False),
+        font=f"Arial {round(FONTSIZE * _CAPTION_SCALE)}",
+        width=WIDTH - 2 * outline,
+        align='centre',
+        dpi=72
+    )
+    mask = mask.embed(outline, outline, mask.width + 2 * outline, mask.height + 2 * outline)
+    # Dilating the glyph mask gives the outline; text pixels are white, the rest black
+    size = 2 * outline + 1
+    border = mask.rank(size, size, size * size - 1)
+    mask.bandjoin([mask, mask, border]).copy(interpretation='srgb').write_to_file(caption_path)
+
+async def make_gifs(batch, subtitles, video_path, subs_file, cue_subs, caption_dir, palette_file, output_dir,
+                    hwaccel, graph_option, semaphore):
+    """Generate the GIFs for a batch of subtitle indices from a single ffmpeg invocation.
+
+    Captions come from the shared subs_file, or from the single-cue file in cue_subs
+    for subtitles that overlap another (libass), or, when caption_dir is set,
+    from PNGs rendered into it for this batch (vips).
+    """
+    results = []
+    pending = [(i, os.path.join(output_dir, subtitles.filenames[i])) for i in batch]
 
-    try:
-        subprocess.run(cmd, check=True, capture_output=True, text=True)
-        if os.path.exists(gif_filepath) and os.path.getsize(gif_filepath) > 0:
-            os.remove(temp_sub_file)
-            return {'text': sub.text, 'path': gif_filepath}
+    # Use '/' for file paths in FFmpeg command, even on Windows (FFmpeg handles it better)
+    def ffmpeg_path(path):
+        return path.replace('\\', '/') if IS_WINDOWS else path
+
+    # Captions are rendered only once the batch holds an ffmpeg slot, so rendering
+    # shares the MAX_WORKERS cap and PNGs exist only for batches being encoded
+    async with semaphore:
+        caption_files = []
+        if caption_dir is not None:
+            # libvips does its work outside the GIL, so the batch's captions are
+            # rendered side by side on the loop's reusable thread pool. Every render
+            # is waited for, so none is still writing once the batch moves on.
+            renders = await asyncio.gather(*(
+                asyncio.to_thread(render_caption, subtitles.texts[i], os.path.join(caption_dir, f"caption_{i}.png"))
+                for i, _ in pending
+            ), return_exceptions=True)
+            rendered = []
+            for (i, gif_filepath), error in zip(pending, renders):
+                if error is None:
+                    rendered.append((i, gif_filepath))
+                elif isinstance(error, pyvips.Error):
+                    # Only this subtitle is dropped; the rest of the batch is still encoded
+                    logging.error(f"Error rendering caption for subtitle {i}: {error}")
+                else:
+                    raise error
+            pending = rendered
+            caption_files = [os.path.join(caption_dir, f"caption_{i}.png") for i, _ in pending]
+            if not pending:
+                return results
+
+        try:
+            # The batch is decoded once, from the first start to the last end, and
+            # every subtitle is cut out of that single decode with its own trim branch.
+            batch_start = subtitles.starts[pending[0][0]]
+            batch_end = max(subtitles.ends[i] for i, _ in pending)
+
+            # Frames between the subtitles are dropped right after fps, so only the
+            # ones some branch keeps are scaled and captioned
+            cue_ranges = "+".join(
+                f"between(t,{subtitles.starts[i]:.3f},{subtitles.ends[i]:.3f})" for i, _ in pending
+            )
+            # Every branch is mapped onto the video's shared palette (input 1)
+            source = f"[0:v]fps={FPS},select='{cue_ranges}',scale={WIDTH}:-1:flags={SCALE_FLAGS},"
+            if caption_dir is None and any(i not in cue_subs for i, _ in pending):
+                # Captions are burned in once, before the split; each branch then only
+                # has to trim its subtitle's range out of the captioned stream. -copyts
+                # keeps the original timestamps so they line up with the shared SRT.
+                source += f"subtitles={escape_filter_arg(ffmpeg_path(subs_file))}:{_SUBTITLES_STYLE},"
+            graph = [
+                source + f"split={len(pending)}" + "".join(f"[s{k}]" for k in range(len(pending))),
+                f"[1:v]split={len(pending)}" + "".join(f"[p{k}]" for k in range(len(pending))),
+            ]
+            outputs = []
+            for k, (i, gif_filepath) in enumerate(pending):
+                branch = f"[s{k}]trim=start={subtitles.starts[i]:.3f}:end={subtitles.ends[i]:.3f},"
+                if i in cue_subs:
+                    # Overlapping subtitles are left out of the shared SRT, so that no
+                    # GIF shows another line's caption, and get their own one here
+                    branch += f"subtitles={escape_filter_arg(ffmpeg_path(cue_subs[i]))}:{_SUBTITLES_STYLE},"
+                graph.append(branch + f"setpts=PTS-STARTPTS[t{k}]")
+                if caption_files:
+                    # Each branch overlays its own pre-rendered caption (inputs 2 onward)
+                    graph.append(f"[t{k}][{k + 2}:v]overlay=x=(W-w)/2:y=H-h-{_CAPTION_MARGIN}[c{k}]")
+                    graph.append(f"[c{k}][p{k}]{_PALETTEUSE}[o{k}]")
+                else:
+                    graph.append(f"[t{k}][p{k}]{_PALETTEUSE}[o{k}]")
+                outputs += ['-map', f'[o{k}]', '-f', 'gif', gif_filepath]
+            filter_string = ";".join(graph)
+
+            # Parallelism comes from running several ffmpeg processes, so each one
+            # decodes on a single thread to avoid oversubscribing the CPU
+            cmd = list(_BATCH_CMD)
+            if hwaccel:
+                cmd += ['-hwaccel', hwaccel]
+
+            # Input-side -ss jumps straight to the keyframe before the batch using the
+            # container index. Sources with a broken index can fail to seek, so those
+            # are retried reading from the beginning; the trims use absolute
+            # timestamps and select the same frames either way. The seeked run logs
+            # warnings so that a failed seek shows up in its log.
+            seek_args = ['-v', 'warning', '-ss', f'{batch_start:.3f}', '-t', f'{batch_end - batch_start:.3f}']
+            fallback_args = ['-v', 'error', '-to', f'{batch_end:.3f}']
+
+            # The filtergraph grows with the batch, so it is streamed to ffmpeg over
+            # stdin rather than passed on the command line (which is length-limited)
+            graph_args = ['-i', ffmpeg_path(video_path), '-i', ffmpeg_path(palette_file)]
+            for caption_file in caption_files:
+                graph_args += ['-i', ffmpeg_path(caption_file)]
+            graph_args += [graph_option, 'pipe:0'] + outputs
+
+            try:
+                log = await run_ffmpeg(cmd + seek_args + graph_args, filter_string)
+            except subprocess.CalledProcessError as e:
+                if not _SEEK_ERROR_RE.search(e.stderr):
+                    raise
+                log = e.stderr
+            # After a failed seek ffmpeg decodes from the start, but -t still counts
+            # from the seek point, so the outputs can be empty or cut short
+            seek_error = _SEEK_ERROR_RE.search(log)
+            if seek_error:
+                logging.warning(
+                    f"Seeking failed for subtitles {[i for i, _ in pending]}, retrying without seek: {seek_error.group()}"
+                )
+                await run_ffmpeg(cmd + fallback_args + graph_args, filter_string)
+
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error generating GIFs for subtitles {[i for i, _ in pending]}: {e.stderr}")
+        finally:
+            for caption_file in caption_files:
+                os.remove(caption_file)
+
+    # ffmpeg's exit code alone is not enough: a branch that selects no frames can
+    # leave an empty file behind on success, while one bad branch (e.g. a subtitle
+    # past the end of the video) fails the run even though the other outputs are
+    # complete. So each output is checked either way.
+    for i, gif_filepath in pending:
+        if is_nonempty_file(gif_filepath):
+            results.append({'text': subtitles.raw_texts[i], 'path': gif_filepath})
         else:
             logging.error(f"Error: Empty GIF generated for subtitle {i}")
-            return None
-    except subprocess.CalledProcessError as e:
-        logging.error(f"Error generating GIF for subtitle {i}: {e.stderr}")
-        return None
-    finally:
-        if os.path.exists(temp_sub_file):
-            os.remove(temp_sub_file)
 
-def process_video(video_file, subtitle_file):
-    """Process a video by generating GIFs for each subtitle."""
+    return results
+
+def write_metadata(output_dir, metadata_list):
+    """Write metadata.json for a video's GIFs, sorted by subtitle number, if there are any."""
+    if not metadata_list:
+        return
+    metadata_list.sort(key=lambda x: int(os.path.basename(x['path']).split('-')[0]))
+    metadata_path = os.path.join(output_dir, "metadata.json")
+    try:
+        if orjson is not None:
+            with open(metadata_path, "wb") as f:
+                f.write(orjson.dumps(metadata_list, option=orjson.OPT_INDENT_2))
+        else:
+            with open(metadata_path, "w", encoding='utf-8') as f:
+                json.dump(metadata_list, f, ensure_ascii=False, indent=2)
+    except IOError as e:
+        logging.error(f"Error writing metadata file: {e}")
+
+async def process_video(video_file, subtitle_file, hwaccel, graph_option, semaphore, pbar):
+    """Process a video by generating GIFs for each subtitle, reporting progress to the shared bar."""
     video_name = os.path.splitext(os.path.basename(video_file))[0]
     output_dir = os.path.join(OUTPUT_DIR, video_name)
     os.makedirs(output_dir, exist_ok=True)
 
     logging.info(f"Processing video: {video_name}")
 
+    # Cues are streamed straight from the file: tags are stripped once, skipped
+    # lines are dropped as they are read, and the rest go into parallel lists
+    total_subs = 0
+    starts, ends, texts, raw_texts = [], [], [], []
     try:
-        subs = pysrt.open(subtitle_file, encoding="utf-8")
+        for start, end, raw_text in iter_srt(subtitle_file):
+            total_subs += 1
+            text = striptags(raw_text)
+            if no_skips(text):
+                starts.append(start)
+                ends.append(end)
+                texts.append(text)
+                raw_texts.append(raw_text)
     except IOError as e:
         logging.error(f"Error reading subtitle file {subtitle_file}: {e}")
         return
 
-    filtered_subs = [sub for sub in subs if no_skips(sub)]
-
-    logging.info(f"Total subtitles: {len(subs)}")
-    logging.info(f"Filtered subtitles: {len(filtered_subs)}")
+    subtitles = Subtitles(
+        starts=starts,
+        ends=ends,
+        texts=texts,
+        filenames=[f'{i:06}-{slugify(text)}.gif' for i, text in enumerate(texts)],
+        raw_texts=raw_texts,
+    )
 
-    tasks = [
-        (i, sub, video_file, subtitle_file, output_dir)
-        for i, sub in enumerate(filtered_subs)
-    ]
+    logging.info(f"Total subtitles: {total_subs}")
+    logging.info(f"Filtered subtitles: {len(texts)}")
+    pbar.total += len(texts)
+    pbar.refresh()
+
+    # List GIFs left by a previous run once, rather than stat-ing every output path.
+    # Empty ones come from an interrupted run or a branch without frames: they are
+    # removed, and the batch command overwrites (-y) any that get made again.
+    existing_gifs = set()
+    with os.scandir(output_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.gif') and entry.is_file():
+                if entry.stat().st_size > 0:
+                    existing_gifs.add(entry.name)
+                else:
+                    os.remove(entry.path)
 
-    start_time = time.time()
     metadata_list = []
+    pending = []
+    for i, gif_filename in enumerate(subtitles.filenames):
+        if gif_filename in existing_gifs:
+            metadata_list.append({'text': raw_texts[i], 'path': os.path.join(output_dir, gif_filename)})
+        else:
+            pending.append(i)
+    pbar.update(len(metadata_list))
+
+    if not pending:
+        # Nothing to encode (every GIF exists, or no subtitles are left), so no
+        # temporary files or palette pass over the video are needed
+        write_metadata(output_dir, metadata_list)
+        logging.info(f"Completed processing {video_name}.")
+        return
 
-    # Parallel processing of subtitles
-    with tqdm(total=len(filtered_subs), desc=f"Processing {video_name}", unit="gif") as pbar:
-        with ProcessPoolExecutor(max_workers=MAX_WORKERS) as executor:
-            future_to_task = {executor.submit(make_gif, task): task for task in tasks}
-            for future in as_completed(future_to_task):
-                result = future.result()
-                if result:
-                    metadata_list.append(result)
-                pbar.update(1)
-                elapsed_time = time.time() - start_time
-                pbar.set_postfix(elapsed=f"{elapsed_time:.2f}s")
-
-    if metadata_list:
-        metadata_list.sort(key=lambda x: int(os.path.basename(x['path']).split('-')[0]))
-        metadata_path = os.path.join(output_dir, "metadata.json")
+    # Temp files get unique names so they never clash with GIFs or with leftovers
+    # of an interrupted run in the output directory
+    subs_dir = subs_file = caption_dir = None
+    cue_subs = {}
+    if CAPTION_RENDERER == "vips":
+        # Batches render their captions into this directory just before running ffmpeg
+        caption_dir = tempfile.mkdtemp(prefix="temp_captions_", dir=output_dir)
+    else:
+        # Write the captions of every filtered subtitle to one file, shared by all
+        # batches, except those overlapping another, which each get their own file
+        subs_dir = tempfile.mkdtemp(prefix="temp_subs_", dir=output_dir)
+        subs_file = os.path.join(subs_dir, "all.srt")
+        overlapping = find_overlapping(starts, ends)
         try:
-            with open(metadata_path, "w", encoding='utf-8') as f:
-                json.dump(metadata_list, f, ensure_ascii=False, indent=4)
+            write_srt(subs_file, (
+                (start, end, text) for i, (start, end, text) in enumerate(zip(starts, ends, texts))
+                if i not in overlapping
+            ))
+            for i in overlapping:
+                cue_subs[i] = os.path.join(subs_dir, f"cue_{i}.srt")
+                write_srt(cue_subs[i], [(starts[i], ends[i], texts[i])])
         except IOError as e:
-            logging.error(f"Error writing metadata file: {e}")
+            logging.error(f"Error writing temporary subtitle file: {e}")
+            rmtree(subs_dir)
+            return
+
+    # Batch subtitle indices in playback order so each ffmpeg call decodes one short span
+    batches = make_batches(pending, starts, ends)
+
+    async def run_batch(batch):
+        metadata_list.extend(await make_gifs(
+            batch, subtitles, video_file, subs_file, cue_subs, caption_dir, palette_file, output_dir,
+            hwaccel, graph_option, semaphore
+        ))
+        # tqdm redraws at most every mininterval (0.1s) on update and already
+        # shows elapsed time, so no extra postfix formatting or refresh here
+        pbar.update(len(batch))
+
+    # Parallel processing of subtitles: the semaphore, shared by all videos,
+    # caps concurrent ffmpeg processes
+    fd, palette_file = tempfile.mkstemp(prefix="temp_palette_", suffix=".png", dir=output_dir)
+    os.close(fd)
+    try:
+        try:
+            await make_palette(video_file, palette_file, semaphore)
+        except subprocess.CalledProcessError as e:
+            logging.error(f"Error generating palette for {video_name}: {e.stderr}")
+            return
+
+        await asyncio.gather(*(run_batch(batch) for batch in batches))
+    finally:
+        if subs_dir:
+            rmtree(subs_dir)
+        if caption_dir:
+            rmtree(caption_dir)
+        os.remove(palette_file)
 
+    write_metadata(output_dir, metadata_list)
     logging.info(f"Completed processing {video_name}.")
 
+def scan_files(directory):
+    """Yield (path, directory, stem, lowercase extension) for every file below directory, top-down."""
+    subdirs = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.path)
+                else:
+                    stem, ext = os.path.splitext(entry.name)
+                    yield entry.path, directory, stem, ext.lower()
+    except OSError as e:
+        # Like os.walk, an unreadable folder is skipped rather than ending the run
+        logging.warning(f"Skipping folder {directory}: {e}")
+        return
+    for subdir in subdirs:
+        yield from scan_files(subdir)
+
 def find_video_pairs(input_dir):
     """Find matching video and subtitle file pairs in the input directory and subdirectories."""
     video_files = []
-    subtitle_files = []
+    # Subtitles indexed for O(1) pairing: by name for the root folder, by folder otherwise
+    subs_by_name = {}  # (directory, stem) -> subtitle paths
+    subs_by_dir = {}   # directory -> subtitle paths
 
     # Walk through the input directory and its subdirectories
-    for root, dirs, files in os.walk(input_dir):
-        for file in files:
-            ext = os.path.splitext(file)[1].lower()
-            if ext in ['.mp4', '.mkv', '.avi', '.mov']:
-                video_files.append(os.path.join(root, file))
-            elif ext in ['.srt', '.sub', '.ass']:
-                subtitle_files.append(os.path.join(root, file))
+    for path, directory, stem, ext in scan_files(input_dir):
+        if ext in VIDEO_EXTENSIONS:
+            video_files.append((directory, stem, path))
+        elif ext in SUBTITLE_EXTENSIONS:
+            subs_by_name.setdefault((directory, stem), []).append(path)
+            subs_by_dir.setdefault(directory, []).append(path)
 
     # Pair based on same-name matching if in the root input folder
     # Pair any video file with any subtitle file in subfolders regardless of name
     video_pairs = []
-    for video in video_files:
-        video_name = os.path.splitext(os.path.basename(video))[0]
-        video_dir = os.path.dirname(video)
+    for video_dir, video_name, video in video_files:
         if video_dir == input_dir:
             # Same-name matching in root input folder
-            matching_subtitle = next(
-                (sub for sub in subtitle_files if os.path.splitext(os.path.basename(sub))[0] == video_name),
-                None
-            )
-            if matching_subtitle:
-                video_pairs.append((video, matching_subtitle))
+            matching_subtitles = subs_by_name.get((video_dir, video_name))
+            if matching_subtitles:
+                video_pairs.append((video, matching_subtitles[0]))
         else:
             # Match any video with any subtitle in the same subfolder
-            sub_in_same_folder = [sub for sub in subtitle_files if os.path.dirname(sub) == video_dir]
-            for sub in sub_in_same_folder:
+            for sub in subs_by_dir.get(video_dir, []):
                 video_pairs.append((video, sub))
 
     return video_pairs
 
-def main():
+def parse_args():
+    """Parse command-line options that override the configuration above."""
+    parser = argparse.ArgumentParser(description="Generate captioned GIFs for every subtitle line of your videos.")
+    parser.add_argument(
+        '--scale-flags',
+        choices=['fast_bilinear', 'bilinear', 'bicubic', 'lanczos'],
+        default=SCALE_FLAGS,
+        help=f"resampling filter used to resize frames (default: {SCALE_FLAGS}); lanczos is sharper but slower"
+    )
+    return parser.parse_args()
+
+async def main():
     """Main entry point of the script."""
+    global SCALE_FLAGS
+    SCALE_FLAGS = parse_args().scale_flags
+
     check_ffmpeg_installed()
 
     # Create the input directory if it doesn't exist
@@ -232,6 +673,10 @@ def main():
         logging.info(f"Input directory '{INPUT_DIR}' created. Please add video and subtitle files to it.")
         sys.exit(1)
 
+    if CAPTION_RENDERER == "vips" and pyvips is None:
+        logging.error("CAPTION_RENDERER is set to 'vips' but pyvips is not installed (pip install pyvips).")
+        sys.exit(1)
+
     os.makedirs(OUTPUT_DIR, exist_ok=True)
 
     video_pairs = find_video_pairs(INPUT_DIR)
@@ -239,19 +684,37 @@ def main():
         logging.error("No matching video and subtitle files found in the input directory.")
         sys.exit(1)
 
+    hwaccel = detect_hwaccel()
+    if hwaccel:
+        logging.info(f"Using hardware decoding: {hwaccel}")
+    graph_option = detect_filter_script_option()
+
+    # Output directories are named after the video alone, so a video with several
+    # subtitle files, or same-named videos in different folders, share one. Pairs
+    # sharing a directory run one after another, so later ones reuse the GIFs of
+    # earlier ones and never write the same files at once.
+    pairs_by_output = {}
     for video_file, subtitle_file in video_pairs:
-        process_video(video_file, subtitle_file)
+        video_name = os.path.splitext(os.path.basename(video_file))[0]
+        pairs_by_output.setdefault(video_name, []).append((video_file, subtitle_file))
+
+    async def process_pairs(pairs):
+        for video_file, subtitle_file in pairs:
+            await process_video(video_file, subtitle_file, hwaccel, graph_option, semaphore, pbar)
+
+    # Different output directories are processed concurrently so the ffmpeg slots
+    # stay busy across video boundaries; the progress bar grows as each video's
+    # subtitles are read
+    semaphore = asyncio.Semaphore(MAX_WORKERS)
+    with tqdm(total=0, desc="Processing", unit="gif") as pbar:
+        await asyncio.gather(*(process_pairs(pairs) for pairs in pairs_by_output.values()))
 
     logging.info("All videos have been processed.")
 
 
 if __name__ == '__main__':
-    # Fix for multiprocessing on Windows
-    if IS_WINDOWS:
-        multiprocessing.set_start_method('spawn')
-
     try:
-        main()
+        asyncio.run(main())
     except Exception as e:
         logging.error(f"An unexpected error occurred: {e}")
         sys.exit(1)
\ No newline at end of file